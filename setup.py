@@ -61,11 +61,17 @@ def setup_package():
         classifiers=[f for f in CLASSIFIERS.split('\n') if f],
         install_requires=[
             'matplotlib>=1.3.0',
-            'numpy>=1.6.0',
+            'numpy>=1.10.0',
             'pandas>=0.13.0',
             'scikit-learn>=0.14.0',
             'scipy>=0.9.0'
-        ]
+        ],
+        extras_require={
+            'fast': [
+                'astropy>=3.2',
+                'numba>=0.49'
+            ]
+        }
     )
 
     from setuptools import setup
@@ -3,14 +3,13 @@ Light curve fitting and plotting functions.
 """
 
 import numpy
-numpy.random.seed(0)
 from scipy.stats import sem
 from sys import stderr
-from math import floor
 from os import path
 import plotypus.utils
 from .utils import (verbose_print, make_sure_path_exists,
-                    get_signal, get_noise, colvec, mad)
+                    get_signal, split_signal_noise, colvec, repeat_cycle,
+                    mad)
 from .periodogram import find_period, Lomb_Scargle, rephase
 from .preprocessing import Fourier
 from sklearn.cross_validation import cross_val_score
@@ -46,6 +45,9 @@ def make_predictor(regressor=LassoLarsIC(fit_intercept=False),
     regressor : object with "fit" and "transform" methods, optional
         Regression object used for solving Fourier matrix
         (default ``sklearn.linear_model.LassoLarsIC(fit_intercept=False)``).
+        Design matrices are shared between degrees only if *regressor* has no
+        *copy_X* attribute or it is True, as a regressor which modifies its
+        input in place cannot be given the cached, read-only matrices.
     Selector : class with "fit" and "predict" methods, optional
         Model selection class used for finding the best fit
         (default :class:`sklearn.grid_search.GridSearchCV`).
@@ -69,8 +71,12 @@ def make_predictor(regressor=LassoLarsIC(fit_intercept=False),
     out : object with "fit" and "predict" methods
         The created predictor object.
     """
+    # cached design matrices are read-only, so they are only shared with
+    # regressors which copy their input before modifying it
+    max_degree = fourier_degree[1] if getattr(regressor, 'copy_X', True) \
+                 else None
     fourier = Fourier(degree_range=fourier_degree, regressor=regressor) \
-              if use_baart else Fourier()
+              if use_baart else Fourier(max_degree=max_degree)
     pipeline = Pipeline([('Fourier', fourier), ('Regressor', regressor)])
     if use_baart:
         return pipeline
@@ -133,8 +139,9 @@ def get_lightcurve(data, copy=False, name=None,
         Upper bound on period obtained by *periodogram* (default 32.0).
     course_precision : positive number, optional
         Precision used in first period search sweep (default 1e-5).
-    fine_precision : positive number, optional
-        Precision used in second period search sweep (default 1e-9).
+    fine_precision : positive number or None, optional
+        Precision used in second period search sweep, or None to skip the
+        second sweep (default 1e-9).
     period_processes : positive integer, optional
         Number of processes to use for period finding (default 1).
     sigma : number, optional
@@ -193,33 +200,35 @@ def get_lightcurve(data, copy=False, name=None,
     if predictor is None:
         predictor = make_predictor(scoring=scoring, scoring_cv=scoring_cv)
 
+    # all of the data, including outliers, phased with the current period
+    phased_data = None
     while True:
         signal = get_signal(data)
         if len(signal) <= scoring_cv:
             verbose_print(
-                "{}: length of signal ({}) less than cv folds ({})".format(
-                    name, len(signal), scoring_cv),
+                "{}: length of signal ({}) less than cv folds ({})",
+                name, len(signal), scoring_cv,
                 operation="coverage", verbosity=verbosity)
             return
         elif len(signal) < min_observations:
             verbose_print(
                 "{}: length of signal ({}) "
-                "less than min_observations ({})".format(
-                    name, len(signal), min_observations),
+                "less than min_observations ({})",
+                name, len(signal), min_observations,
                 operation="coverage", verbosity=verbosity)
             return
         # Find the period of the inliers
         if period is not None:
             _period = period
         else:
-            verbose_print("{}: finding period".format(name),
+            verbose_print("{}: finding period", name,
                           operation="period", verbosity=verbosity)
             _period = find_period(signal,
                                   min_period, max_period,
                                   coarse_precision, fine_precision,
                                   periodogram, period_processes)
 
-        verbose_print("{}: using period {}".format(name, _period),
+        verbose_print("{}: using period {}", name, _period,
                       operation="period", verbosity=verbosity)
         phase, mag, *err = rephase(signal, _period).T
 
@@ -227,12 +236,12 @@ def get_lightcurve(data, copy=False, name=None,
 # Generalize number of bins to function parameter ``coverage_bins``, which
 # defaults to 100, the current hard-coded behavior
         # Determine whether there is sufficient phase coverage
-        coverage = numpy.zeros((100))
-        for p in phase:
-            coverage[int(floor(p*100))] = 1
-        coverage = sum(coverage)/100
+        coverage = numpy.zeros(100, dtype=bool)
+        coverage[numpy.clip((numpy.ma.getdata(phase)*100).astype(int),
+                            0, 99)] = True
+        coverage = coverage.mean()
         if coverage < min_phase_cover:
-            verbose_print("{}: {} {}".format(name, coverage, min_phase_cover),
+            verbose_print("{}: {} {}", name, coverage, min_phase_cover,
                           operation="coverage",
                           verbosity=verbosity)
             verbose_print("Insufficient phase coverage",
@@ -251,22 +260,28 @@ def get_lightcurve(data, copy=False, name=None,
 
         # Reject outliers and repeat the process if there are any
         if sigma:
-            outliers = find_outliers(rephase(data.data, _period), predictor,
+            # a fixed period leaves the phases unchanged between iterations,
+            # in which case their Fourier design matrix is also reused
+            if period is None or phased_data is None:
+                phased_data = rephase(data.data, _period)
+            outliers = find_outliers(phased_data, predictor,
                                      sigma, sigma_clipping)
-            num_outliers = sum(outliers)[0]
+            # outliers are whole rows, so their first column is enough
+            row_outliers = outliers[:, 0]
+            num_outliers = numpy.count_nonzero(row_outliers)
+            # stop once there are no outliers which are not already masked
             if num_outliers == 0 or \
-               set.issubset(set(numpy.nonzero(outliers.T[0])[0]),
-                            set(numpy.nonzero(data.mask.T[0])[0])):
+               not numpy.any(row_outliers &
+                             ~numpy.ma.getmaskarray(data)[:, 0]):
                 data.mask = outliers
                 break
-            if num_outliers > 0:
-                verbose_print("{}: {} outliers".format(name, sum(outliers)[0]),
-                              operation="outlier",
-                              verbosity=verbosity)
+            verbose_print("{}: {} outliers", name, num_outliers,
+                          operation="outlier",
+                          verbosity=verbosity)
             data.mask = numpy.ma.mask_or(data.mask, outliers)
 
     # Build light curve and optionally shift to max light
-    lightcurve = predictor.predict([[i] for i in phases])
+    lightcurve = predictor.predict(colvec(phases))
     if shift is None:
         arg_max_light = lightcurve.argmin()
         lightcurve = numpy.concatenate((lightcurve[arg_max_light:],
@@ -336,7 +351,7 @@ def get_lightcurve_from_file(file, *args, use_cols=None, skiprows=0,
         return get_lightcurve(masked_data, *args,
                               verbosity=verbosity, **kwargs)
     else:
-        verbose_print("{}: file contains no data points".format(file),
+        verbose_print("{}: file contains no data points", file,
                       operation="coverage", verbosity=verbosity)
         return
 
@@ -398,14 +413,17 @@ def find_outliers(data, predictor, sigma,
     **Returns**
 
     out : array-like, shape = data.shape
-        Boolean array indicating the outliers in the given *data* array.
+        Read-only boolean array indicating the outliers in the given *data*
+        array. Every row is entirely True or entirely False, and all columns
+        are views of the same memory.
     """
     phase, mag, *err = data.T
     residuals = numpy.absolute(predictor.predict(colvec(phase)) - mag)
-    outliers = numpy.logical_and((residuals > err[0]) if err else True,
-                                 residuals > sigma * method(residuals))
+    outliers = residuals > sigma * method(residuals)
+    if err:
+        outliers &= residuals > err[0]
 
-    return numpy.tile(numpy.vstack(outliers), data.shape[1])
+    return numpy.broadcast_to(outliers[:, numpy.newaxis], data.shape)
 
 
 def plot_lightcurve(name, lightcurve, period, data,
@@ -432,6 +450,9 @@ def plot_lightcurve(name, lightcurve, period, data,
         Directory to save plot to (default '.').
     legend : boolean, optional
         Whether or not to display legend on plot (default False).
+    sanitize_latex : boolean, optional
+        Whether or not to escape *name* for LaTeX in the plot title
+        (default False).
     color : boolean, optional
         Whether or not to display color in plot (default True).
     n_phases : integer, optional
@@ -448,33 +469,33 @@ def plot_lightcurve(name, lightcurve, period, data,
     ax.invert_yaxis()
     plt.xlim(0,2)
 
+    inlier_data, outlier_data = split_signal_noise(data)
+
     # Plot points used
-    phase, mag, *err = get_signal(data).T
+    phase, mag, *err = inlier_data.T
 
-    error = err[0] if err else mag*err_const
+    mag = repeat_cycle(mag)
+    error = repeat_cycle(err[0]) if err else mag*err_const
 
-    inliers = plt.errorbar(numpy.hstack((phase,1+phase)),
-                           numpy.hstack((mag, mag)),
-                           yerr=numpy.hstack((error, error)),
+    inliers = plt.errorbar(repeat_cycle(phase, 1), mag, yerr=error,
                            ls='None',
                            ms=.01, mew=.01, capsize=0)
 
     # Plot outliers rejected
-    phase, mag, *err = get_noise(data).T
+    phase, mag, *err = outlier_data.T
 
-    error = err[0] if err else mag*err_const
+    mag = repeat_cycle(mag)
+    error = repeat_cycle(err[0]) if err else mag*err_const
 
-    outliers = plt.errorbar(numpy.hstack((phase,1+phase)),
-                            numpy.hstack((mag, mag)),
-                            yerr=numpy.hstack((error, error)),
+    outliers = plt.errorbar(repeat_cycle(phase, 1), mag, yerr=error,
                             ls='None', marker='o' if color else 'x',
                             ms=.01 if color else 4,
                             mew=.01 if color else 1,
                             capsize=0 if color else 1)
 
     # Plot the fitted light curve
-    signal, = plt.plot(numpy.hstack((phases,1+phases)),
-                       numpy.hstack((lightcurve, lightcurve)),
+    signal, = plt.plot(repeat_cycle(phases, 1),
+                       repeat_cycle(lightcurve),
                        linewidth=1)
 
     if legend:
@@ -485,7 +506,7 @@ def plot_lightcurve(name, lightcurve, period, data,
     plt.xlabel('Phase ({0:0.7} day period)'.format(period))
     plt.ylabel('Magnitude')
 
-    plt.title(utils.sanitize_latex(name) if sanitize_latex else name)
+    plt.title(plotypus.utils.sanitize_latex(name) if sanitize_latex else name)
     plt.tight_layout(pad=0.1)
     make_sure_path_exists(output)
     plt.savefig(path.join(output, name))
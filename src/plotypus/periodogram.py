@@ -3,8 +3,16 @@ Period finding and rephasing functions.
 """
 import numpy as np
 from scipy.signal import lombscargle
-from multiprocessing import Pool
-from functools import partial
+try:
+    from astropy.timeseries import LombScargle
+except ImportError:
+    LombScargle = None
+try:
+    from numba import (config, get_num_threads, njit, prange,
+                       set_num_threads)
+except ImportError:
+    njit = None
+from .utils import pmap
 
 
 __all__ = [
@@ -16,12 +24,29 @@ __all__ = [
     'get_phase'
 ]
 
+# Number of frequencies evaluated by each call of astropy's fast method, whose
+# FFT grids are sized by the number of frequencies rather than of samples.
+# Each call then needs a pair of 2**19 point complex grids, 8 MiB each.
+_fast_chunk_size = 2**16
+
 
 def Lomb_Scargle(data, precision, min_period, max_period, period_jobs=1):
     """
     Returns the period of *data* according to the
     `Lomb-Scargle periodogram <https://en.wikipedia.org/wiki/Least-squares_spectral_analysis#The_Lomb.E2.80.93Scargle_periodogram>`_.
 
+    If `astropy <http://www.astropy.org/>`_ is installed, the periodogram is
+    evaluated with the fast O(N log N) method of Press & Rybicki. Its FFT
+    grids grow with the number of frequencies searched, so the frequencies
+    are evaluated in chunks of at most 65536, which bounds its memory to a
+    few tens of MiB. Otherwise, if `numba <http://numba.pydata.org/>`_ is installed,
+    it is evaluated directly in up to *period_jobs* threads using the
+    formulation of [RHDT]_, and if neither is available
+    :func:`scipy.signal.lombscargle` is used. The frequency of
+    the highest peak is refined by fitting a parabola to the periodogram at
+    that peak and its two neighbors, so the returned period is more precise
+    than the grid spacing *precision*.
+
     **Parameters**
 
     data : array-like, shape = [n_samples, 2] or [n_samples, 3]
@@ -32,23 +57,140 @@ def Lomb_Scargle(data, precision, min_period, max_period, period_jobs=1):
         Minimum period in search-space.
     max_period : number
         Maximum period in search-space.
-    period_jobs : int, optional
-        Number of simultaneous processes to use while searching. Only one
-        process will ever be used, but argument is included to conform to
-        *periodogram* standards of :func:`find_period` (default 1).
+    period_jobs : int or None, optional
+        Number of threads to use while searching if numba is used, or all
+        available threads if None. Otherwise only one process will ever be
+        used, but argument is included to conform to *periodogram* standards
+        of :func:`find_period` (default 1).
 
     **Returns**
 
     period : number
         The period of *data*.
+
+    **Citations**
+
+    .. [RHDT] R. H. D. Townsend, 2010,
+              "Fast Calculation of the Lomb-Scargle Periodogram Using
+              Graphics Processing Units",
+              The Astrophysical Journal Supplement Series, Vol. 191, p. 247
     """
     time, mags, *err = data.T
     scaled_mags = (mags-mags.mean())/mags.std()
     minf, maxf = 2*np.pi/max_period, 2*np.pi/min_period
     freqs = np.arange(minf, maxf, precision)
-    pgram = lombscargle(time, scaled_mags, freqs)
+    if LombScargle is not None:
+        # astropy works in cycles per unit time, rather than angular frequency
+        periodogram = LombScargle(time, scaled_mags, fit_mean=False,
+                                  normalization='standard')
+        # chunks of equal size, so that none is too short to be regular
+        n_chunks = -(-freqs.size // _fast_chunk_size)
+        pgram = np.concatenate([
+            periodogram.power(chunk/(2*np.pi), method='fast',
+                              assume_regular_frequency=True)
+            for chunk in np.array_split(freqs, max(n_chunks, 1))])
+    elif njit is not None:
+        pgram = _in_threads(_lomb_scargle, _lomb_scargle_serial, period_jobs,
+                            np.ascontiguousarray(time, dtype=float),
+                            np.ascontiguousarray(scaled_mags, dtype=float),
+                            freqs)
+    else:
+        pgram = lombscargle(time, scaled_mags, freqs)
+
+    return 2*np.pi/_peak_frequency(freqs, pgram)
+
+
+def _in_threads(kernel, serial_kernel, period_jobs, *args):
+    """
+    Returns the result of the parallel numba *kernel* called with *args*,
+    using at most *period_jobs* threads, or all of numba's threads if None.
+    If *period_jobs* is 1, *serial_kernel* is called instead, so that numba's
+    threads are never started.
+    """
+    if period_jobs == 1:
+        return serial_kernel(*args)
+
+    threads = config.NUMBA_NUM_THREADS if period_jobs is None else \
+              max(1, min(period_jobs, config.NUMBA_NUM_THREADS))
+    previous_threads = get_num_threads()
+    set_num_threads(threads)
+    try:
+        return kernel(*args)
+    finally:
+        set_num_threads(previous_threads)
+
 
-    return 2*np.pi/freqs[np.argmax(pgram)]
+def _peak_frequency(freqs, pgram):
+    """
+    Returns the frequency at the maximum of *pgram*, interpolated between the
+    evenly spaced *freqs* by the vertex of the parabola through the highest
+    point and its two neighbors.
+    """
+    i = np.argmax(pgram)
+    if i == 0 or i == pgram.size-1:
+        return freqs[i]
+    left, center, right = pgram[i-1:i+2]
+    curvature = left - 2*center + right
+    if curvature >= 0:
+        return freqs[i]
+    # offset of the vertex from freqs[i], in units of the grid spacing
+    offset = 0.5*(left - right)/curvature
+
+    return freqs[i] + offset*(freqs[i+1] - freqs[i])
+
+
+if njit is not None:
+    @njit(fastmath=True, cache=True)
+    def _lomb_scargle_power(time, mags, omega):
+        """
+        Returns the Lomb-Scargle periodogram of *time* and *mags* at the
+        angular frequency *omega*. All sums are accumulated in a single pass
+        over the data, following equation (5) of [RHDT]_.
+        """
+        XC = XS = CC = SS = CS = 0.0
+        for j in range(time.size):
+            c = np.cos(omega * time[j])
+            s = np.sin(omega * time[j])
+            XC += mags[j] * c
+            XS += mags[j] * s
+            CC += c * c
+            SS += s * s
+            CS += c * s
+        # time offset tau, which makes the periodogram invariant to shifts in
+        # time, is given by tan(2 omega tau) = 2 CS / (CC - SS)
+        omega_tau = 0.5 * np.arctan2(2 * CS, CC - SS)
+        c_tau = np.cos(omega_tau)
+        s_tau = np.sin(omega_tau)
+        cs_tau = 2 * c_tau * s_tau * CS
+        return 0.5 * (
+            (c_tau*XC + s_tau*XS)**2
+                / (c_tau*c_tau*CC + cs_tau + s_tau*s_tau*SS) +
+            (c_tau*XS - s_tau*XC)**2
+                / (c_tau*c_tau*SS - cs_tau + s_tau*s_tau*CC))
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _lomb_scargle(time, mags, freqs):
+        """
+        Returns the Lomb-Scargle periodogram of *time* and *mags* at the
+        angular frequencies *freqs*, equivalent to
+        :func:`scipy.signal.lombscargle`, with the frequencies divided between
+        numba's threads.
+        """
+        pgram = np.empty(freqs.size)
+        for i in prange(freqs.size):
+            pgram[i] = _lomb_scargle_power(time, mags, freqs[i])
+        return pgram
+
+    @njit(fastmath=True, cache=True)
+    def _lomb_scargle_serial(time, mags, freqs):
+        """
+        Serial equivalent of :func:`_lomb_scargle`, which does not start
+        numba's threads.
+        """
+        pgram = np.empty(freqs.size)
+        for i in range(freqs.size):
+            pgram[i] = _lomb_scargle_power(time, mags, freqs[i])
+        return pgram
 
 
 def conditional_entropy(data, precision, min_period, max_period,
@@ -57,6 +199,10 @@ def conditional_entropy(data, precision, min_period, max_period,
     Returns the period of *data* by minimizing conditional entropy.
     See `link <http://arxiv.org/pdf/1306.6664v2.pdf>`_ [GDDMD] for details.
 
+    If `numba <http://numba.pydata.org/>`_ is installed, the entropies of all
+    trial periods are computed in a single compiled loop, otherwise
+    :func:`CE` is called once for each trial period.
+
     **Parameters**
 
     data : array-like, shape = [n_samples, 2] or [n_samples, 3]
@@ -71,10 +217,10 @@ def conditional_entropy(data, precision, min_period, max_period,
         Number of phase bins for each trial period (default 10).
     ybins : int, optional
         Number of magnitude bins for each trial period (default 5).
-    period_jobs : int, optional
-        Number of simultaneous processes to use while searching. Only one
-        process will ever be used, but argument is included to conform to
-        *periodogram* standards of :func:`find_period` (default 1).
+    period_jobs : int or None, optional
+        Number of simultaneous processes to use while searching. If numba is
+        installed, it is instead the number of threads the search is run in,
+        or all available threads if None (default 1).
 
     **Returns**
 
@@ -92,9 +238,15 @@ def conditional_entropy(data, precision, min_period, max_period,
     copy = np.ma.copy(data)
     copy[:,1] = (copy[:,1]  - np.min(copy[:,1])) \
        / (np.max(copy[:,1]) - np.min(copy[:,1]))
-    partial_job = partial(CE, data=copy, xbins=xbins, ybins=ybins)
-    m = map if period_jobs <= 1 else Pool(period_jobs).map
-    entropies = list(m(partial_job, periods))
+    if njit is not None:
+        entropies = _in_threads(
+            _conditional_entropies, _conditional_entropies_serial, period_jobs,
+            np.ascontiguousarray(np.ma.getdata(copy[:,0]), dtype=float),
+            np.ascontiguousarray(np.ma.getdata(copy[:,1]), dtype=float),
+            periods, xbins, ybins)
+    else:
+        entropies = pmap(CE, periods, processes=period_jobs,
+                         data=copy, xbins=xbins, ybins=ybins)
 
     return periods[np.argmin(entropies)]
 
@@ -164,6 +316,62 @@ def CE(period, data, xbins=10, ybins=5):
         return np.PINF
 
 
+if njit is not None:
+    @njit(fastmath=True, cache=True)
+    def _conditional_entropy(time, mag, period, xbins, ybins):
+        """
+        Returns the conditional entropy of *time* and *mag* rephased with
+        *period*, equivalent to :func:`CE`. *mag* must already be normalized
+        to the interval [0, 1].
+        """
+        size = time.size
+        if period <= 0 or size == 0:
+            return np.inf
+        # 2D histogram of phase and magnitude, where the right edge of the
+        # last bin is inclusive, as in np.histogram2d
+        bins = np.zeros((xbins, ybins))
+        for i in range(size):
+            x = min(int((time[i] / period % 1) * xbins), xbins-1)
+            y = min(int(mag[i] * ybins), ybins-1)
+            bins[x, y] += 1
+        # sum of bins[i,j]/size * log(bins[i,:] / bins[i,j])
+        entropy = 0.0
+        for x in range(xbins):
+            row_sum = 0.0
+            for y in range(ybins):
+                row_sum += bins[x, y]
+            for y in range(ybins):
+                if bins[x, y] > 0:
+                    entropy += bins[x, y] / size \
+                             * np.log(row_sum / bins[x, y])
+        return entropy
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _conditional_entropies(time, mag, periods, xbins, ybins):
+        """
+        Returns the conditional entropy of *time* and *mag* rephased with each
+        of the given *periods*, equivalent to calling :func:`CE` on each
+        period, with the periods divided between numba's threads.
+        """
+        entropies = np.empty(periods.size)
+        for k in prange(periods.size):
+            entropies[k] = _conditional_entropy(time, mag, periods[k],
+                                                xbins, ybins)
+        return entropies
+
+    @njit(fastmath=True, cache=True)
+    def _conditional_entropies_serial(time, mag, periods, xbins, ybins):
+        """
+        Serial equivalent of :func:`_conditional_entropies`, which does not
+        start numba's threads.
+        """
+        entropies = np.empty(periods.size)
+        for k in range(periods.size):
+            entropies[k] = _conditional_entropy(time, mag, periods[k],
+                                                xbins, ybins)
+        return entropies
+
+
 def find_period(data,
                 min_period=0.2, max_period=32.0,
                 coarse_precision=1e-5, fine_precision=1e-9,
@@ -173,6 +381,9 @@ def find_period(data,
 
     Returns the period of *data* according to the given *periodogram*,
     searching first with a coarse precision, and then a fine precision.
+    The second search is skipped if *fine_precision* is None, in which case
+    the period is only as precise as the peak which *periodogram* finds on
+    the coarse grid, such as the interpolated peak of :func:`Lomb_Scargle`.
 
     **Parameters**
 
@@ -185,9 +396,9 @@ def find_period(data,
     coarse_precision : number
         Distance between contiguous frequencies in search-space during first
         sweep.
-    fine_precision : number
+    fine_precision : number or None
         Distance between contiguous frequencies in search-space during second
-        sweep.
+        sweep, or None to skip the second sweep.
     periodogram : function
         A function with arguments *data*, *precision*, *min_period*,
         *max_period*, and *period_jobs*, and return value *period*.
@@ -205,7 +416,8 @@ def find_period(data,
     coarse_period = periodogram(data, coarse_precision, min_period, max_period,
                                 period_jobs=period_jobs)
 
-    return coarse_period if coarse_precision <= fine_precision else \
+    return coarse_period if fine_precision is None or \
+                            coarse_precision <= fine_precision else \
         periodogram(data, fine_precision,
                     coarse_period - coarse_precision,
                     coarse_period + coarse_precision,
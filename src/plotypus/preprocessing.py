@@ -1,16 +1,33 @@
 """
 Light curve space transformation preprocessors for regressing upon.
 """
+from threading import Lock
 import numpy
 from numpy import pi
 from sklearn.linear_model import LinearRegression
 from sklearn.pipeline import Pipeline
 from .utils import autocorrelation, rowvec
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 __all__ = [
     'Fourier'
 ]
 
+# Design matrices of transformed phases, at their Fourier object's
+# *max_degree*. Shared at module level so that they survive the cloning done
+# by model selectors, which search over degrees on the same phases.
+_design_matrix_cache = {}
+# Limit on the total size of the cached matrices, in bytes. Once it is
+# reached, the oldest matrices are evicted to make room for new ones, as they
+# belong to phases which are least likely to be used again.
+_design_matrix_cache_limit = 64 * 2**20
+_design_matrix_cache_bytes = 0
+# guards the cache and its size against Fourier objects in other threads
+_design_matrix_cache_lock = Lock()
+
 
 class Fourier():
     r"""
@@ -66,12 +83,23 @@ class Fourier():
         via :func:`baart_criteria`. Not used otherwise
         (default
         ``sklearn.linear_model.LinearRegression(fit_intercept=False)``).
+    max_degree : positive int or None, optional
+        Largest *degree* which will be used on the same phases, or None if
+        design matrices are not to be cached. If given, the design matrix is
+        built once at *max_degree* for each set of phases, and smaller degrees
+        are read-only views of its leading columns. The cache is shared by all
+        Fourier objects and limited to 64 MiB, beyond which the oldest
+        matrices are evicted; see :func:`clear_cache`. Regressors
+        given the transformed phases must not modify them in place
+        (default None).
     """
     def __init__(self, degree=3, degree_range=None,
-                 regressor=LinearRegression(fit_intercept=False)):
+                 regressor=LinearRegression(fit_intercept=False),
+                 max_degree=None):
         self.degree = degree
         self.degree_range = degree_range
         self.regressor = regressor
+        self.max_degree = max_degree
 
     def fit(self, X, y=None):
         """
@@ -101,8 +129,8 @@ class Fourier():
 
         **Parameters**
 
-        X : array-like, shape = [n_samples, 1]
-            Column vector of phases.
+        X : array-like, shape = [n_samples, 1] or [n_samples]
+            Column vector or row vector of phases.
         y : None, optional
             Unused argument for conformity (default None).
 
@@ -111,10 +139,15 @@ class Fourier():
         design_matrix : array-like, shape = [n_samples, 2*degree+1]
             Fourier design matrix produced by :func:`Fourier.design_matrix`.
         """
-        data = numpy.dstack((numpy.array(X).T[0], range(len(X))))[0]
-        phase, order = data[data[:,0].argsort()].T
-        design_matrix = self.design_matrix(phase, self.degree)
-        return design_matrix[order.argsort()]
+        # rows of the design matrix are independent of one another, so
+        # there is no need to sort the phases beforehand
+        phases = numpy.asarray(X).ravel()
+        if self.max_degree is None or self.degree > self.max_degree:
+            return self.design_matrix(phases, self.degree)
+
+        # the columns of a design matrix are the leading columns of every
+        # design matrix of higher degree
+        return _cached_design_matrix(phases, self.degree, self.max_degree)
 
     def get_params(self, deep=False):
         """
@@ -130,7 +163,7 @@ class Fourier():
         params : dict
             Mapping of parameter name to value.
         """
-        return {'degree': self.degree}
+        return {'degree': self.degree, 'max_degree': self.max_degree}
 
     def set_params(self, **params):
         """
@@ -142,6 +175,8 @@ class Fourier():
         """
         if 'degree' in params:
             self.degree = params['degree']
+        if 'max_degree' in params:
+            self.max_degree = params['max_degree']
 
         return self
 
@@ -163,15 +198,46 @@ class Fourier():
             raise ValueError("Degree range must be a length two sequence")
 
         cutoff = self.baart_tolerance(X)
-        pipeline = Pipeline([('Fourier', Fourier()),
-                             ('Regressor', self.regressor)])
-        sorted_X = numpy.sort(X, axis=0)
+        # sort once by phase, rather than once for X and again for y
         X_sorting = numpy.argsort(rowvec(X))
+        sorted_X = X[X_sorting]
+        sorted_y = y[X_sorting]
+        sorted_phases = rowvec(sorted_X)
+
+        # an ordinary least squares fit is the projection of y onto the
+        # columns of the design matrix, and the columns for each degree are
+        # the leading columns of the next, so a single QR decomposition at the
+        # highest degree gives the fit at every degree. This requires the
+        # design matrix to have full column rank, which it does when there are
+        # at least as many distinct phases as columns. A LinearRegression
+        # constrained to positive coefficients is not a projection, and so
+        # is fit degree by degree.
+        if isinstance(self.regressor, LinearRegression) and \
+           not getattr(self.regressor, 'positive', False) and \
+           numpy.count_nonzero(numpy.diff(sorted_phases)) >= 2*max_degree-2:
+            Q, _ = numpy.linalg.qr(self.design_matrix(sorted_phases,
+                                                      max_degree-1))
+            Q_y = Q.T.dot(sorted_y)
+            for degree in range(min_degree, max_degree):
+                n_columns = 2*degree+1
+                residuals = sorted_y - Q[:, :n_columns].dot(Q_y[:n_columns])
+                p_c = autocorrelation(residuals)
+                if abs(p_c) <= cutoff:
+                    return degree
+            # reached max_degree without reaching cutoff
+            return max_degree
+
+        # cached design matrices are read-only, so they are only shared with
+        # regressors which copy their input before modifying it
+        shared_degree = max_degree \
+                        if getattr(self.regressor, 'copy_X', True) else None
+        pipeline = Pipeline([('Fourier', Fourier(max_degree=shared_degree)),
+                             ('Regressor', self.regressor)])
         for degree in range(min_degree, max_degree):
             pipeline.set_params(Fourier__degree=degree)
             pipeline.fit(X, y)
             lc = pipeline.predict(sorted_X)
-            residuals = y[X_sorting] - lc
+            residuals = sorted_y - lc
             p_c = autocorrelation(residuals)
             if abs(p_c) <= cutoff:
                 return degree
@@ -200,6 +266,21 @@ class Fourier():
         """
         return (2 * (len(X) - 1))**(-1/2)
 
+    @staticmethod
+    def clear_cache():
+        """
+        Discards all of the design matrices cached by Fourier objects with a
+        *max_degree*, freeing their memory for matrices of new phases.
+
+        **Returns**
+
+        None
+        """
+        global _design_matrix_cache_bytes
+        with _design_matrix_cache_lock:
+            _design_matrix_cache.clear()
+            _design_matrix_cache_bytes = 0
+
     @staticmethod
     def design_matrix(phases, degree):
         r"""
@@ -233,30 +314,35 @@ class Fourier():
         where :math:`n =` *degree*, :math:`N =` *n_samples*, and
         :math:`\phi_i =` *phases[i]*.
 
+        If `numba <http://numba.pydata.org/>`_ is installed, the matrix is
+        built by a compiled loop which evaluates only the first harmonic with
+        sin and cos, and obtains the rest by angle addition.
+
         Parameters
         ----------
         phases : array-like, shape = [n_samples]
             
         """
+        if njit is not None:
+            return _design_matrix(numpy.ascontiguousarray(phases, dtype=float),
+                                  degree)
+
         n_samples = phases.size
         # initialize coefficient matrix
         M = numpy.empty((n_samples, 2*degree+1))
-        # indices
-        i = numpy.arange(1, degree+1)
-        # initialize the Nxn matrix that is repeated within the
-        # sine and cosine terms
-        x = numpy.empty((n_samples, degree))
-        # the Nxn matrix now has N copies of the same row, and each row is
-        # integer multiples of pi counting from 1 to the degree
-        x[:,:] = i*2*numpy.pi
-        # multiply each row of x by the phases
-        x.T[:,:] *= phases
+        # the Nxn matrix of complex harmonics, whose element [j,k] is
+        # exp(2*pi*i*(k+1)*phases[j]), with the cosine and sine terms as its
+        # real and imaginary parts. Each row is the running product of the
+        # first harmonic, so only one complex exponential per phase is needed
+        harmonics = numpy.empty((n_samples, degree), dtype=complex)
+        harmonics[:,:] = numpy.exp(2j*pi*phases)[:,numpy.newaxis]
+        numpy.cumprod(harmonics, axis=1, out=harmonics)
         # place 1's in the first column of the coefficient matrix
         M[:,0]    = 1
         # the odd indices of the coefficient matrix have sine terms
-        M[:,1::2] = numpy.sin(x)
+        M[:,1::2] = harmonics.imag
         # the even indices of the coefficient matrix have cosine terms
-        M[:,2::2] = numpy.cos(x)
+        M[:,2::2] = harmonics.real
         return M
 
     @staticmethod
@@ -400,3 +486,67 @@ class Fourier():
         phase_deltas   %= 2*pi
 
         return ratios
+
+
+if njit is not None:
+    @njit(fastmath=True, cache=True)
+    def _design_matrix(phases, degree):
+        """
+        Compiled equivalent of :func:`Fourier.design_matrix`. Each harmonic is
+        obtained from the previous one by the angle addition formulas
+
+            sin((k+1) x) = sin(k x) cos(x) + cos(k x) sin(x)
+            cos((k+1) x) = cos(k x) cos(x) - sin(k x) sin(x)
+
+        so sin and cos are only evaluated once per phase.
+        """
+        n_samples = phases.size
+        M = numpy.empty((n_samples, 2*degree+1))
+        for i in range(n_samples):
+            x = 2*pi*phases[i]
+            sin_1 = numpy.sin(x)
+            cos_1 = numpy.cos(x)
+            # harmonic 0
+            sin_k = 0.0
+            cos_k = 1.0
+            M[i, 0] = 1
+            for k in range(degree):
+                sin_k, cos_k = sin_k*cos_1 + cos_k*sin_1, \
+                               cos_k*cos_1 - sin_k*sin_1
+                M[i, 2*k+1] = sin_k
+                M[i, 2*k+2] = cos_k
+        return M
+
+
+def _cached_design_matrix(phases, degree, max_degree):
+    """
+    Returns :func:`Fourier.design_matrix` of *phases* and *degree*, as a
+    read-only view of the cached matrix of *phases* and *max_degree*. If that
+    matrix is not cached, it is built and cached, evicting the oldest cached
+    matrices until it fits within the cache's limit. If it alone exceeds the
+    limit, only the matrix of *degree* is built.
+    """
+    global _design_matrix_cache_bytes
+    key = (max_degree, phases.dtype.str, phases.tobytes())
+    design_matrix = _design_matrix_cache.get(key)
+    if design_matrix is not None:
+        return design_matrix[:, :2*degree+1]
+
+    n_bytes = phases.size * (2*max_degree+1) * 8
+    if n_bytes > _design_matrix_cache_limit:
+        return Fourier.design_matrix(phases, degree)
+    design_matrix = Fourier.design_matrix(phases, max_degree)
+    design_matrix.flags.writeable = False
+    with _design_matrix_cache_lock:
+        # another thread may have cached the same phases in the meantime
+        if key not in _design_matrix_cache:
+            # dicts keep insertion order, so the oldest matrices come first
+            while _design_matrix_cache_bytes + n_bytes > \
+                  _design_matrix_cache_limit:
+                oldest = next(iter(_design_matrix_cache))
+                _design_matrix_cache_bytes -= \
+                    _design_matrix_cache.pop(oldest).nbytes
+            _design_matrix_cache[key] = design_matrix
+            _design_matrix_cache_bytes += n_bytes
+
+    return design_matrix[:, :2*degree+1]
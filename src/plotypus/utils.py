@@ -1,8 +1,18 @@
-from os import makedirs
-from os.path import join, isdir
+from atexit import register
+from os import getpid, makedirs
 from sys import stderr
-from multiprocessing import Pool
-from numpy import absolute, concatenate, median, resize
+from multiprocessing import cpu_count, get_context
+from multiprocessing.pool import ThreadPool
+from functools import partial
+from operator import index
+from numpy import (absolute, asarray, compress, dot, empty, expand_dims,
+                   float32, float64, isnan, median, nan, subtract)
+from numpy.fft import rfft, irfft
+from numpy.ma import getdata, getmask, getmaskarray, nomask
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 __all__ = [
     'verbose_print',
@@ -10,21 +20,29 @@ __all__ = [
     'make_sure_path_exists',
     'get_signal',
     'get_noise',
+    'split_signal_noise',
     'colvec',
+    'repeat_cycle',
     'mad',
-    'autocorrelation'
+    'autocorrelation',
+    'autocorrelation_fft',
+    'sanitize_latex'
 ]
 
 
-def verbose_print(message, *, operation, verbosity):
+def verbose_print(message, *args, operation, verbosity):
     """
     Prints *message* to stderr only if the given *operation* is in the list
     *verbosity*. If "all" is in *verbosity*, all operations are printed.
+    If any *args* are given, *message* is formatted with them, but only if it
+    is going to be printed.
 
     **Parameters**
 
     message : str
-        The message to print.
+        The message to print, or its format string if *args* are given.
+    args : optional
+        Positional arguments for ``message.format``.
     operation : str
         The type of operation being performed.
     verbosity : [str] or None
@@ -38,11 +56,45 @@ def verbose_print(message, *, operation, verbosity):
     """
     if (verbosity is not None) and ((operation in verbosity) or
                                     ("all"     in verbosity)):
-        print(message, file=stderr)
+        print(message.format(*args) if args else message, file=stderr)
 
 
-def pmap(func, args, processes=None, callback=lambda *_, **__: None, **kwargs):
-    """pmap(func, args, processes=None, callback=do_nothing, **kwargs)
+# pool classes for each of pmap's backends, which are given the number of
+# workers and the start method for worker processes
+_pool_types = {
+    'processes': lambda processes, start_method:
+                     get_context(start_method).Pool(processes),
+    'threads':   lambda processes, start_method: ThreadPool(processes)
+}
+
+# pools kept alive between calls to pmap, keyed by the ID of the process
+# which owns them, their backend, their number of workers, and their start
+# method
+_pools = {}
+
+
+def _get_pool(processes, backend, start_method):
+    key = getpid(), backend, processes, start_method
+    pool = _pools.get(key)
+    if pool is None:
+        pool = _pools[key] = _pool_types[backend](processes, start_method)
+
+    return pool
+
+
+@register
+def _close_pools():
+    pid = getpid()
+    for (owner, *_), pool in _pools.items():
+        if owner == pid:
+            # any work still queued is abandoned rather than waited for
+            pool.terminate()
+    _pools.clear()
+
+
+def pmap(func, args, processes=None, callback=lambda *_, **__: None,
+         fresh_pool=True, backend='processes', start_method=None, **kwargs):
+    """pmap(func, args, processes=None, callback=do_nothing, fresh_pool=True, backend='processes', start_method=None, **kwargs)
 
     Parallel equivalent of ``map(func, args)``, with the additional ability of
     providing keyword arguments to func, and a callback function which is
@@ -61,7 +113,28 @@ def pmap(func, args, processes=None, callback=lambda *_, **__: None, **kwargs):
         on your system by :class:`multiprocessing.Pool` (default None).
     callback : function, optional
         Function to call on the return value of ``func(arg)`` for each *arg*
-        in *args* (default do_nothing).
+        in *args*. It is always called in the calling process, in the order
+        of *args* (default do_nothing).
+    fresh_pool : boolean, optional
+        If True, a new pool is created for this call and closed afterwards.
+        Otherwise the pool is kept open and reused by later calls with the
+        same *processes* and *backend*, to avoid starting new processes each
+        time. Reused worker processes keep the definitions of *func* from when
+        they were started, so only reuse pools for functions which are
+        importable and never redefined (default True).
+    backend : str, optional
+        Either "processes", to run *func* in a :class:`multiprocessing.Pool`,
+        or "threads", to run it in a :class:`multiprocessing.pool.ThreadPool`.
+        Threads avoid pickling *func*, *args* and the results, but only run in
+        parallel while *func* releases the GIL, as most of numpy's and
+        scipy's numerical routines do (default "processes").
+    start_method : str or None, optional
+        Start method of the worker processes, as given to
+        :func:`multiprocessing.get_context`, or None for the platform's
+        default. Processes forked after numba's parallel kernels have run in
+        the calling process may hang at exit, which "forkserver" avoids, but
+        *func* must then be importable by the workers. Ignored by the
+        "threads" backend (default None).
     kwargs : dict
         Extra keyword arguments are unpacked in each call of *func*.
 
@@ -69,21 +142,61 @@ def pmap(func, args, processes=None, callback=lambda *_, **__: None, **kwargs):
 
     results : list
         A list equivalent to ``[func(x, **kwargs) for x in args]``.
+
+    **Raises**
+
+    TypeError
+        If *processes* is neither None nor an integer.
+    ValueError
+        If *processes* is less than 1, or *backend* is not recognized.
     """
-    if processes is 1:
+    if backend not in _pool_types:
+        raise ValueError("backend must be 'processes' or 'threads'")
+    if processes is not None:
+        # accepts Python and numpy integers alike, and nothing else
+        processes = index(processes)
+        if processes < 1:
+            raise ValueError("processes must be a positive integer or None")
+
+    if processes == 1:
+        # bind the keyword arguments once, rather than unpacking them per call
+        job = partial(func, **kwargs) if kwargs else func
         results = []
+        append = results.append
         for arg in args:
-            result = func(arg, **kwargs)
-            results.append(result)
+            result = job(arg)
+            append(result)
             callback(result)
 
         return results
     else:
-        with Pool() if processes is None else Pool(processes) as p:
-            results = [p.apply_async(func, (arg,), kwargs, callback)
-                       for arg in args]
+        args = list(args)
+        if processes is None:
+            processes = cpu_count()
+        # send arguments to the workers in batches, so that the cost of
+        # communicating with them is not paid once per argument
+        chunksize = max(1, len(args) // (4*processes))
+        job = partial(func, **kwargs)
 
-            return [result.get() for result in results]
+        results = []
+        pool = (_pool_types[backend](processes, start_method) if fresh_pool
+                else _get_pool(processes, backend, start_method))
+        try:
+            for result in pool.imap(job, args, chunksize):
+                results.append(result)
+                callback(result)
+        except BaseException:
+            # a cached pool would otherwise keep working through the rest of
+            # *args*, including on KeyboardInterrupt
+            if not fresh_pool:
+                _pools.pop((getpid(), backend, processes, start_method), None)
+                pool.terminate()
+            raise
+        finally:
+            if fresh_pool:
+                pool.terminate()
+
+        return results
 
 
 def make_sure_path_exists(path):
@@ -100,11 +213,7 @@ def make_sure_path_exists(path):
 
     None
     """
-    try:
-        makedirs(path)
-    except OSError:
-        if not isdir(path):
-            raise
+    makedirs(path, exist_ok=True)
 
 
 def get_signal(data):
@@ -118,9 +227,15 @@ def get_signal(data):
     **Returns**
 
     signal : array
-        Non-masked values in *data*.
+        Rows of *data* which have no masked values. If *data* has no mask,
+        this is a view of *data* rather than a copy.
     """
-    return data[~data.mask].data.reshape(-1, data.shape[1])
+    mask = getmask(data)
+    if mask is nomask:
+        return getdata(data)
+
+    # numpy.ma.compress_rows would drop the columns when every row is masked
+    return compress(~mask.any(axis=1), getdata(data), axis=0)
 
 
 def get_noise(data):
@@ -134,9 +249,34 @@ def get_noise(data):
     **Returns**
 
     noise : array
-        Masked values in *data*.
+        Rows of *data* which have any masked values.
+    """
+    masked_rows = getmaskarray(data).any(axis=1)
+    return compress(masked_rows, getdata(data), axis=0)
+
+
+def split_signal_noise(data):
     """
-    return data[data.mask].data.reshape(-1, data.shape[1])
+    Returns both the values in *data* that are not outliers and the identified
+    outliers, as given by :func:`get_signal` and :func:`get_noise`, while only
+    reducing the mask of *data* once.
+
+    **Parameters**
+
+    data : masked array
+
+    **Returns**
+
+    signal : array
+        Rows of *data* which have no masked values.
+    noise : array
+        Rows of *data* which have any masked values.
+    """
+    masked_rows = getmaskarray(data).any(axis=1)
+    values = getdata(data)
+
+    return (compress(~masked_rows, values, axis=0),
+            compress(masked_rows, values, axis=0))
 
 
 def colvec(X):
@@ -150,8 +290,9 @@ def colvec(X):
     **Returns**
 
     out : array-like, shape = [n_samples, 1]
+        View of *X* where possible, otherwise a copy.
     """
-    return resize(X, (X.shape[0], 1))
+    return asarray(X).reshape(-1, 1)
 
 
 def rowvec(X):
@@ -165,8 +306,37 @@ def rowvec(X):
     **Returns*
 
     out : array-like, shape = [n_samples]
+        View of *X* where possible, otherwise a copy.
     """
-    return resize(X, (1, X.shape[0]))[0]
+    return asarray(X).reshape(-1)
+
+
+def repeat_cycle(X, offset=0.0):
+    """
+    Returns *X* followed by a copy of *X* with *offset* added to it, for
+    plotting two cycles of a light curve. Equivalent to
+    ``numpy.hstack((X, offset+X))``, without any intermediate arrays.
+
+    **Parameters**
+
+    X : array-like, shape = [n_samples]
+
+    offset : number, optional
+        Number to add to the repeated cycle, such as 1 for phases
+        (default 0.0).
+
+    **Returns**
+
+    out : array-like, shape = [2*n_samples]
+    """
+    n_samples = X.shape[0]
+    out = empty(2*n_samples, dtype=X.dtype)
+    out[:n_samples] = X
+    out[n_samples:] = X
+    if offset:
+        out[n_samples:] += offset
+
+    return out
 
 
 def mad(data, axis=None):
@@ -183,7 +353,48 @@ def mad(data, axis=None):
 
     mad : number or array-like
     """
-    return median(absolute(data - median(data, axis)), axis)
+    if njit is not None and axis == 0 and getmask(data) is nomask:
+        values = getdata(data)
+        if values.ndim == 2 and values.dtype == float64:
+            return _mad_axis0(values)
+
+    center = median(data, axis)
+    if axis is not None:
+        # restore the reduced axis, so that the medians broadcast against
+        # *data* along any axis
+        center = expand_dims(center, axis)
+    # the absolute deviations are computed in place in a single buffer
+    deviations = subtract(data, center)
+    absolute(deviations, out=deviations)
+
+    # the buffer is ours, so the median may partially sort it in place
+    # rather than partitioning a copy
+    return median(deviations, axis, overwrite_input=True)
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _mad_axis0(X):
+        """
+        Compiled equivalent of ``mad(X, axis=0)`` for 2-D float64 arrays,
+        which computes each column's two medians by selection in a single
+        column-sized buffer. It runs serially, so that calling it never starts
+        numba's threads.
+        """
+        n_samples, n_columns = X.shape
+        out = empty(n_columns)
+        for j in range(n_columns):
+            column = X[:, j].copy()
+            # unlike numpy's, numba's median does not propagate NaN
+            if isnan(column).any():
+                out[j] = nan
+                continue
+            center = median(column)
+            for i in range(n_samples):
+                column[i] = abs(X[i, j] - center)
+            out[j] = median(column)
+
+        return out
 
 
 def autocorrelation(X, lag=1):
@@ -203,16 +414,88 @@ def autocorrelation(X, lag=1):
     lag : int, optional
         Index difference between points being compared (default 1).
     """
+    if njit is not None and getmask(X) is nomask:
+        data = getdata(X)
+        if data.ndim == 1 and data.dtype in (float32, float64):
+            return _autocorrelation(data, lag)
+
     differences = X - X.mean()
-    products = differences * concatenate((differences[lag:],
-                                          differences[:lag]))
+    n_samples = X.shape[0]
+    if getmask(differences) is nomask:
+        # lagged slices are views, and a 1-D dot product is a single pass
+        # with no temporaries
+        differences = getdata(differences)
+        return (dot(differences[:n_samples-lag], differences[lag:]) /
+                dot(differences, differences))
+
+    # dot ignores the mask, so masked values go through numpy.ma instead
+    products = differences[:n_samples-lag] * differences[lag:]
 
     return products.sum() / (differences**2).sum()
 
+
+if njit is not None:
+    @njit(fastmath=True, cache=True)
+    def _autocorrelation(X, lag):
+        """
+        Compiled equivalent of :func:`autocorrelation` for 1-D float32 or
+        float64 arrays, which accumulates the autocovariance and variance
+        together without allocating any temporary arrays. Sums are always
+        accumulated in double precision, so float32 input is read at its own
+        width without losing accuracy.
+        """
+        n_samples = X.shape[0]
+        mean = 0.0
+        for i in range(n_samples):
+            mean += X[i]
+        mean /= n_samples
+
+        autocovariance = 0.0
+        variance = 0.0
+        for i in range(n_samples-lag):
+            difference = X[i] - mean
+            autocovariance += difference * (X[i+lag] - mean)
+            variance += difference * difference
+        for i in range(max(n_samples-lag, 0), n_samples):
+            difference = X[i] - mean
+            variance += difference * difference
+
+        return autocovariance / variance
+
+
+def autocorrelation_fft(X, max_lag):
+    """
+    Computes the autocorrelation of *X* at every lag from 0 to *max_lag*,
+    as given by :func:`autocorrelation`, using the fast Fourier transform.
+    This takes O(N log N) time for all lags, rather than O(N) time for each
+    lag.
+
+    **Parameters**
+
+    X : array-like, shape = [n_samples]
+
+    max_lag : int
+        Largest index difference between points being compared.
+
+    **Returns**
+
+    out : array-like, shape = [max_lag+1]
+        Autocorrelations of *X*, where *out[lag]* has the given *lag*.
+    """
+    n_samples = X.shape[0]
+    differences = X - X.mean()
+    # zero-padding to twice the length prevents the circular correlation
+    # computed by the FFT from wrapping around
+    transform = rfft(differences, n=2*n_samples)
+    autocovariance = irfft(transform * transform.conj(),
+                           n=2*n_samples)[:max_lag+1]
+
+    return autocovariance / autocovariance[0]
+
 _latex_replacements = [
     ('\\', '\\\\'),
     ('{',  '\\{'),
-    ('{',  '\\}'),
+    ('}',  '\\}'),
     ('$',  '\\$'),
     ('&',  '\\&'),
     ('#',  '\\#'),
@@ -224,6 +507,9 @@ _latex_replacements = [
     ('>',  '\\textgreater{}'),
     ('|',  '\\textbar{}')
 ]
+# every character is replaced in a single pass, so replacements are never
+# themselves replaced
+_latex_table = str.maketrans(dict(_latex_replacements))
 
 def sanitize_latex(string):
     """
@@ -240,7 +526,5 @@ def sanitize_latex(string):
 
     sanitized_string: str
     """
-    sanitized_string = string
-    for old, new in _latex_replacements:
-        sanitized_string = sanitized_string.replace(old, new)
-    return sanitized_string
+    return string.translate(_latex_table)
+
@@ -2,9 +2,8 @@ from sys import exit
 import numpy as np
 np.random.seed(4) # chosen by fair dice roll. guaranteed to be random.
 from sklearn.linear_model import LinearRegression, LassoCV
-from sklearn.pipeline import Pipeline
 from plotypus.preprocessing import Fourier
-from plotypus.utils import colvec
+from plotypus.utils import colvec, repeat_cycle
 from plotypus.resources import matplotlibrc
 
 import matplotlib
@@ -26,32 +25,32 @@ def main():
     X_sample = np.random.uniform(size=n_samples)
     y_sample = lc(X_sample) + np.random.normal(0, 0.1, n_samples)
     
-    predictor = Pipeline([('Fourier', Fourier(9)),
-                          ('OLS',   LinearRegression())])
-    predictor = predictor.fit(colvec(X_sample), y_sample)
-    y_pred = predictor.predict(colvec(X_true))
+    # both regressors are fit to the same design matrices
+    fourier = Fourier(9)
+    F_sample = fourier.transform(colvec(X_sample))
+    F_true = fourier.transform(colvec(X_true))
     
-    predictor = Pipeline([('Fourier', Fourier(9)),
-                          ('Lasso',   LassoCV())])
-    predictor = predictor.fit(colvec(X_sample), y_sample)
-    y_lasso = predictor.predict(colvec(X_true))
+    y_pred = LinearRegression().fit(F_sample, y_sample).predict(F_true)
+    
+    y_lasso = LassoCV().fit(F_sample, y_sample).predict(F_true)
     
     ax = plt.gca()
-    signal, = plt.plot(np.hstack((X_true,1+X_true)),
-                       np.hstack((y_true, y_true)), 
+    X_true_cycles = repeat_cycle(X_true, 1)
+    signal, = plt.plot(X_true_cycles,
+                       repeat_cycle(y_true), 
                        linewidth=0.66, color='black')
     
-    fd, = plt.plot(np.hstack((X_true,1+X_true)),
-                   np.hstack((y_pred, y_pred)), 
+    fd, = plt.plot(X_true_cycles,
+                   repeat_cycle(y_pred), 
                    linewidth=2.5, ls='dashed',
                    color='darkred' if color else 'black')
     
-    lasso, = plt.plot(np.hstack((X_true,1+X_true)),
-                      np.hstack((y_lasso, y_lasso)), 
+    lasso, = plt.plot(X_true_cycles,
+                      repeat_cycle(y_lasso), 
                       linewidth=3, color='black', ls='dotted')
     
-    sc = plt.scatter(np.hstack((X_sample,1+X_sample)),
-                     np.hstack((y_sample, y_sample)),
+    sc = plt.scatter(repeat_cycle(X_sample, 1),
+                     repeat_cycle(y_sample),
                      marker='+', s=20,
                      color='darkblue' if color else 'black')
     